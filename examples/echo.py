@@ -7,7 +7,7 @@ from utils import *
 def handler(stream, addr):
     try:
         while True:
-            data = yield stream.read_bytes(1024, partial=True)
+            data = yield stream.read_bytes(65536, partial=True)
             yield stream.write(data)
     except IOError:
         pass
@@ -0,0 +1,48 @@
+from __future__ import print_function
+
+import multiprocessing
+
+from microio import *
+from utils import *
+
+
+def handler(stream, addr):
+    try:
+        while True:
+            data = yield stream.read_bytes(65536, partial=True)
+            yield stream.write(data)
+    except IOError:
+        pass
+    finally:
+        stream.close()
+
+
+def server(address):
+    sock = listen(address)
+    yield serve(sock, handler)
+
+
+def worker(address):
+    try:
+        loop(server(address))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    # Each worker binds its own SO_REUSEPORT listen socket and runs its
+    # own loop; the kernel spreads incoming connections between them
+    workers = [multiprocessing.Process(target=worker,
+                                       args=(('127.0.0.1', 25000),))
+               for _ in range(multiprocessing.cpu_count())]
+    for proc in workers:
+        proc.start()
+    try:
+        for proc in workers:
+            proc.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,7 @@ def handler(csock):
             data = csock.recv(65536)
             if not data:
                 raise IOError('Connection closed')
+            data = memoryview(data)  # Slicing a view below is zero-copy
             while data:
                 yield csock, POLLWRITE
                 sent = csock.send(data)
@@ -31,6 +32,7 @@ def server(address):
             if err & POLLERROR:
                 raise IOError()
             csock, addr = sock.accept()
+            set_nodelay(csock)
             yield spawn(handler(csock))
     except IOError:
         yield sock, None
@@ -5,7 +5,7 @@ import time
 from microio import *
 
 
-__all__ = ('Stream', 'connect', 'listen', 'serve', 'spawn')
+__all__ = ('Stream', 'connect', 'listen', 'serve', 'set_nodelay', 'spawn')
 
 
 class Stream:
@@ -13,64 +13,91 @@ class Stream:
     def __init__(self, sock, read_size=65536):
         sock.setblocking(False)
         self.sock = sock
-        self.buffer = b''
+        self.buffer = bytearray()
         self.read_size = read_size
+        # Reused wait requests, so IO yields allocate no tuples
+        self._read_wait = (sock, POLLREAD | POLLERROR)
+        self._write_wait = (sock, POLLWRITE | POLLERROR)
+        self._unregister = (sock, None)
 
     def close(self):
         self.sock.close()
 
+    def _consume(self, n):
+        buffer = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return buffer
+
     def read_bytes(self, n, partial=False):
+        if len(self.buffer) >= n:  # Serve from the buffer without yielding
+            raise Return(self._consume(n))
         try:
             while len(self.buffer) < n:
-                err = yield self.sock, POLLREAD | POLLERROR
+                err = yield self._read_wait
                 if err & POLLERROR:
                     raise IOError()
-                data = self.sock.recv(self.read_size)
-                if not data:
-                    raise IOError('Connection closed')
-                self.buffer += data
-                if partial:
+                self._drain(n)
+                if partial and self.buffer:
                     break
-            yield self.sock, None
+            yield self._unregister
         except IOError:
-            yield self.sock, None
-        buffer = self.buffer[:n]
-        self.buffer = self.buffer[n:]
-        raise Return(buffer)
+            yield self._unregister
+        raise Return(self._consume(n))
+
+    def _drain(self, n):
+        # Read everything the socket has, so one readiness wakeup is not
+        # paid per read_size chunk
+        while len(self.buffer) < n:
+            try:
+                data = self.sock.recv(self.read_size)
+            except (BlockingIOError, InterruptedError):
+                break
+            if not data:
+                raise IOError('Connection closed')
+            self.buffer += data
 
     def read_until(self, pat, n=65536):
+        idx = self.buffer.find(pat)
+        if idx != -1:  # Serve from the buffer without yielding
+            raise Return(self._consume(idx + len(pat)))
+        scanned = len(self.buffer)
         try:
-            while pat not in self.buffer and len(self.buffer) < n:
-                err = yield self.sock, POLLREAD | POLLERROR
+            while idx == -1 and len(self.buffer) < n:
+                err = yield self._read_wait
                 if err & POLLERROR:
                     raise IOError()
-                data = self.sock.recv(self.read_size)
-                if not data:
-                    raise IOError('Connection closed')
-                self.buffer += data
-            yield self.sock, None
+                self._drain(n)
+                # Rescan only the new data plus a pattern-sized overlap
+                idx = self.buffer.find(pat, max(0, scanned - len(pat) + 1))
+                scanned = len(self.buffer)
+            yield self._unregister
         except IOError:
-            yield self.sock, None
-        if pat not in self.buffer:
+            yield self._unregister
+            # The drain may have buffered data it did not get to scan
+            idx = self.buffer.find(pat, max(0, scanned - len(pat) + 1))
+        if idx == -1:
             raise IOError('Buffer limit exceeded')
-        n = self.buffer.find(pat) + len(pat)
-        buffer = self.buffer[:n]
-        self.buffer = self.buffer[n:]
-        raise Return(buffer)
+        raise Return(self._consume(idx + len(pat)))
 
     def write(self, data):
+        data = memoryview(data)  # Slicing a view below is zero-copy
         try:
             while data:
-                err = yield self.sock, POLLWRITE | POLLERROR
+                err = yield self._write_wait
                 if err & POLLERROR:
                     raise IOError()
-                sent = self.sock.send(data)
-                if not sent:
-                    raise IOError('Connection closed')
-                data = data[sent:]
-            yield self.sock, None
+                # Write as much as the socket accepts before waiting again
+                while data:
+                    try:
+                        sent = self.sock.send(data)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    if not sent:
+                        raise IOError('Connection closed')
+                    data = data[sent:]
+            yield self._unregister
         except IOError:
-            yield self.sock, None
+            yield self._unregister
 
 
 def connect(address):
@@ -94,12 +121,26 @@ def connect(address):
 def listen(address):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        # Lets several processes bind the same address and have the
+        # kernel balance accepts between them
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    set_nodelay(sock)
     sock.bind(address)
     sock.setblocking(False)
     sock.listen(128)
     return sock
 
 
+def set_nodelay(sock):
+    # Nagle plus delayed ACK can add up to 40ms to every small
+    # request/response exchange
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (AttributeError, OSError):
+        pass
+
+
 def serve(sock, handler):
     try:
         while True:
@@ -107,6 +148,7 @@ def serve(sock, handler):
             if err & POLLERROR:
                 raise IOError()
             csock, addr = sock.accept()
+            set_nodelay(csock)
             stream = Stream(csock)
             yield spawn(handler(stream, addr))
     except IOError:
@@ -20,7 +20,7 @@
 
 
 >>> def delayed_print():
-...     yield time.time() + 0.1  # Delay for 0.1 second
+...     yield time.monotonic() + 0.1  # Delay for 0.1 second
 ...     print("delayed_print")
 
 >>> def main_task():
@@ -37,9 +37,9 @@ True
 
 
 >>> def main_task():
-...     t1 = time.time()
-...     yield time.time() + 0.5
-...     t2 = time.time() - t1
+...     t1 = time.monotonic()
+...     yield time.monotonic() + 0.5
+...     t2 = time.monotonic() - t1
 ...     raise Return(t2 >= 0.5)
 
 >>> loop(main_task())
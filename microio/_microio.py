@@ -2,13 +2,14 @@
 `microio` - dumb event loop
 """
 
-from collections import deque, defaultdict
+from collections import deque
+from inspect import CO_GENERATOR
+from itertools import count
+from types import FunctionType, GeneratorType
 import heapq
-import inspect
 import logging
-import select
-import socket
-import sys
+import selectors
+import threading
 import time
 import traceback
 
@@ -24,154 +25,202 @@ class Return(BaseException):
         self.value = value
 
 
-if hasattr(select, "epoll"):
-    POLLREAD = select.EPOLLIN
-    POLLWRITE = select.EPOLLOUT
-    POLLERROR = select.EPOLLERR | select.EPOLLHUP
-    Poll = select.epoll
-elif hasattr(select, "poll"):
-    POLLREAD = select.POLLIN
-    POLLWRITE = select.POLLOUT
-    POLLERROR = select.POLLERR | select.POLLHUP
-    Poll = select.poll
-else:
-    POLLREAD = 0x01
-    POLLWRITE = 0x02
-    POLLERROR = 0x04
-
-    class Poll:
-
-        def __init__(self):
-            self.readers = set()
-            self.writers = set()
-            self.errors = set()
-
-        def register(self, fd, mask):
-            if mask & POLLREAD:
-                self.readers.add(fd)
-            if mask & POLLWRITE:
-                self.writers.add(fd)
-            if mask & POLLERROR:
-                self.errors.add(fd)
-
-        def modify(self, fd, mask):
-            self.unregister(fd)
-            self.register(fd, mask)
-
-        def unregister(self, fd):
-            self.readers.discard(fd)
-            self.writers.discard(fd)
-            self.errors.discard(fd)
-
-        def poll(self, timeout=-1):
-            if not any((self.readers, self.writers, self.errors)):
-                time.sleep(max(0.0, timeout))
-                return []
-            if timeout < 0.0:
-                timeout = None
-            r, w, x = select.select(self.readers, self.writers,
-                                    self.errors, timeout)
-            events = defaultdict(lambda: 0)
-            for fd in r:
-                events[fd] |= POLLREAD
-            for fd in w:
-                events[fd] |= POLLWRITE
-            for fd in x:
-                events[fd] |= POLLERROR
-            return list(events.items())
+POLLREAD = selectors.EVENT_READ
+POLLWRITE = selectors.EVENT_WRITE
+# `selectors` reports error conditions as read/write readiness, so there
+# is no separate error event.  The flag is kept for compatibility and is
+# masked out at registration time.
+POLLERROR = 0x4
+
+# One selector per thread, reused by consecutive loop() calls
+_poll_cache = threading.local()
 
 
 def loop(task, hide_loop_tb=False, quiet_exc=False):
-    poll = Poll()
-    sockets = {}
+    """Run `task` and every task spawned from it to completion.
+
+    Tasks are plain generators; `async def` coroutines and other
+    iterators are rejected with RuntimeError.  A task may yield:
+
+    - a generator: run it as a subroutine and resume with its result;
+    - a generator function: spawn it as a new task;
+    - `(sock, mask)`: wait for IO readiness, `(sock, None)` unregisters;
+    - a float or int: sleep until that `time.monotonic()` deadline;
+    - `None`: reschedule, letting other tasks run.
+    """
+    poll = getattr(_poll_cache, "poll", None)
+    if poll is None:
+        poll = _poll_cache.poll = selectors.DefaultSelector()
+    sockets = {}  # Registered events and waiter per socket, shared with poll
     timeouts = []
-    io_waiters = {}
-    tasks = deque()
-    tasks.append((task, [], None, None))
+    timeout_seq = count()  # Tiebreaker for equal deadlines
+    ready = deque()
+    # Side tables are keyed by id() of the task: int hashing is cheaper
+    # than the object hash protocol, and the tasks are kept alive by the
+    # queue, the poll records, the timeout heap or their waiters anyway
+    send_val = {}  # Pending send values, stored only when not None
+    send_exc = {}  # Pending exceptions, stored only when not None
+    waiters = {}  # Suspended subroutine callers, keyed by id of callee
+    ready.append(task)
     root = task
     root_ret = None
 
-    while any((tasks, timeouts, sockets)):
-        if tasks:
-            current, stack, val, exc = tasks.popleft()
-            try:
-                if exc:  # There was an exception in subroutine
-                    yielded = current.throw(*exc)
-                else:
-                    yielded = current.send(val)
-                if inspect.isgenerator(yielded):  # Subroutine call
-                    stack.append(current)
-                    tasks.append((yielded, stack, None, None))
-                elif inspect.isgeneratorfunction(yielded):  # New task
-                    tasks.append((yielded(), [], None, None))
-                    tasks.append((current, stack, None, None))
-                elif isinstance(yielded, tuple):  # Requst to wait for IO event
+    def handle_subroutine(current, yielded):  # Subroutine call
+        waiters[id(yielded)] = current
+        # Enter the subroutine in place: the caller cannot run until it
+        # finishes, so there is nothing to round-trip through the queue
+        return yielded
+
+    def handle_io(current, yielded):  # Request to wait for IO event
+        try:
+            sock, mask = yielded
+        except ValueError:
+            raise RuntimeError(current)
+        if not hasattr(sock, 'fileno'):
+            raise RuntimeError(current)
+        if mask is None:
+            old = sockets.pop(sock, None)
+            if old is not None:
+                poll.unregister(sock)
+            ready.append(current)
+        else:
+            events = mask & (POLLREAD | POLLWRITE)
+            record = sockets.get(sock, None)
+            if record is None:
+                record = [events, current]
+                sockets[sock] = record
+                poll.register(sock, events, record)
+            else:
+                if record[0] != events:  # Skip no-op re-registration
+                    poll.modify(sock, events, record)
+                    record[0] = events
+                record[1] = current
+
+    def handle_new_task(current, yielded):  # New task
+        if not yielded.__code__.co_flags & CO_GENERATOR:
+            raise RuntimeError(current)
+        # The spawning task continues first
+        ready.append(yielded())
+        ready.appendleft(current)
+
+    def handle_timeout(current, yielded):  # Request to wait for timeout
+        heapq.heappush(timeouts, (yielded, next(timeout_seq), current))
+
+    def handle_reschedule(current, yielded):  # Task rescheduling
+        if not ready and not timeouts and not sockets:
+            # Nothing else can possibly run: resume in place instead of
+            # paying a queue round trip and an empty poll
+            return current
+        ready.append(current)
+
+    # Single dict lookup on type() instead of an isinstance() ladder
+    dispatch = {
+        GeneratorType: handle_subroutine,
+        FunctionType: handle_new_task,
+        tuple: handle_io,
+        float: handle_timeout,
+        int: handle_timeout,
+        type(None): handle_reschedule,
+    }
+
+    # Pre-bound methods: LOAD_FAST instead of LOAD_ATTR on every tick
+    _monotonic = time.monotonic
+    _popleft = ready.popleft
+    _append = ready.append
+    _pop_val = send_val.pop
+    _pop_exc = send_exc.pop
+    _pop_waiter = waiters.pop
+    _get_handler = dispatch.get
+    _select = poll.select
+    _heappop = heapq.heappop
+
+    try:
+        while ready or timeouts or sockets:
+            # Run every task that is already runnable, then poll once; tasks
+            # requeued during the batch wait for the next iteration
+            for _ in range(len(ready)):
+                current = _popleft()
+                current_id = id(current)
+                val = _pop_val(current_id, None)
+                exc = _pop_exc(current_id, None)
+                while True:
                     try:
-                        sock, mask = yielded
-                    except ValueError:
-                        raise RuntimeError(current)
-                    if not hasattr(sock, 'fileno'):
-                        raise RuntimeError(current)
-                    fd = sock.fileno()
-                    if mask is None:
-                        old = sockets.pop(fd, None)
-                        if old is not None:
-                            poll.unregister(fd)
-                        tasks.append((current, stack, None, None))
-                    else:
-                        old = sockets.get(fd, None)
-                        sockets[fd] = mask
-                        if old is None:
-                            poll.register(fd, mask)
+                        if exc is not None:  # Exception in subroutine
+                            yielded = current.throw(exc)
+                        else:
+                            yielded = current.send(val)
+                        handler = _get_handler(type(yielded))
+                        if handler is None:
+                            raise RuntimeError(current)
+                        nxt = handler(current, yielded)
+                    except (StopIteration, Return) as e:
+                        # Value can be returned using `raise Return(value)` in
+                        # py2 or with `return value` in py3
+                        waiter = _pop_waiter(current_id, None)
+                        if waiter is not None:
+                            value = getattr(e, "value", None)
+                            if value is not None:
+                                send_val[id(waiter)] = value
+                            _append(waiter)
+                        elif current == root:
+                            root_ret = getattr(e, "value", None)
+                        break
+                    except Exception as e:  # Exceptions are passed to callers
+                        waiter = _pop_waiter(current_id, None)
+                        if waiter is not None:
+                            if hide_loop_tb:
+                                e.__traceback__ = e.__traceback__.tb_next
+                            send_exc[id(waiter)] = e
+                            _append(waiter)
+                        elif not quiet_exc:  # Reraise if task is on top level
+                            raise
                         else:
-                            poll.modify(fd, mask)
-                        io_waiters[fd] = (current, stack)
-                # Request to wait for timeout
-                elif isinstance(yielded, (float, int)):
-                    heapq.heappush(timeouts, (yielded, id(current),
-                                              current, stack))
-                elif yielded is None:  # Can be used for task rescheduling
-                    tasks.append((current, stack, None, None))
-                else:
-                    raise RuntimeError(current)
-            except (StopIteration, Return) as e:
-                # Value can be returned using `raise Return(value)` in py2
-                # or with `return value` in py3
-                if stack:
-                    tasks.append((stack.pop(), stack,
-                                  getattr(e, "value", None), None))
-                elif current == root:
-                    root_ret = getattr(e, "value", None)
-            except Exception:  # Other exceptions are passed to callers
-                if stack:
-                    exc_type, exc_val, exc_tb = sys.exc_info()
-                    if hide_loop_tb:
-                        exc_tb = exc_tb.tb_next
-                    tasks.append((stack.pop(), stack,
-                                  None, (exc_type, exc_val, exc_tb)))
-                elif not quiet_exc:  # Reraise if current task is on top level
-                    raise
-                else:
-                    exc_logger.warn("Exception in {}:\n{}"
-                                    .format(current.__name__,
-                                            traceback.format_exc()))
-
-        timeout = -1
-        if tasks or not sockets:
-            # If there is active tasks or no sockets, do quick check on events
+                            exc_logger.warn("Exception in {}:\n{}"
+                                            .format(current.__name__,
+                                                    traceback.format_exc()))
+                        break
+                    if nxt is None:
+                        break
+                    # Handler picked the task to keep running in place
+                    current = nxt
+                    current_id = id(current)
+                    val = None
+                    exc = None
+
             timeout = 0.0
-        elif timeouts:
-            # If there is pending timeout, wait for events up to it
-            timeout = max(0.0, timeouts[0][0] - time.time())
-        for fd, mask in poll.poll(timeout):
-            waiter = io_waiters.pop(fd, None)
-            if waiter:
-                tasks.append((waiter[0], waiter[1], mask, None))
-
-        if timeouts:
-            timeout, _, waiter, stack = timeouts[0]  # Handle earliest timeout
-            if time.time() >= timeout:
-                heapq.heappop(timeouts)
-                tasks.append((waiter, stack, None, None))
+            if not ready:
+                if timeouts:
+                    # If there is pending timeout, wait for events up to it
+                    timeout = max(0.0, timeouts[0][0] - _monotonic())
+                elif sockets:
+                    # Only IO left, block until some event arrives
+                    timeout = None
+            if sockets:
+                events = _select(timeout)
+            else:
+                # select() with an empty interest set raises OSError on
+                # some platforms (Windows select()); sleep out any timer
+                # wait ourselves and skip the syscall entirely otherwise
+                if timeout:
+                    time.sleep(timeout)
+                events = ()
+            for key, mask in events:
+                record = key.data
+                waiter = record[1]
+                if waiter is not None:
+                    # Drop the waiter so a still-ready fd wakes it only once
+                    record[1] = None
+                    send_val[id(waiter)] = mask
+                    _append(waiter)
+
+            if timeouts:
+                now = _monotonic()
+                # Drain expired timeouts
+                while timeouts and timeouts[0][0] <= now:
+                    _append(_heappop(timeouts)[2])
+    finally:
+        # Leave the shared selector clean for the next loop() call
+        for sock in sockets:
+            poll.unregister(sock)
 
     return root_ret